@@ -9,6 +9,11 @@ sys.path.insert(0, str(TESTS_DIR.parent / "vistopian"))
 from vistopian.main import main
 
 
+@pytest.fixture(autouse=True)
+def cache_home(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+
 def test_cli_list_show_content(
     cli_runner: click.testing.CliRunner
 ):
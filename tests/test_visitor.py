@@ -3,6 +3,12 @@ import sys
 from pathlib import Path
 import os
 import itertools
+import io
+import threading
+import time
+
+import requests
+from urllib3.exceptions import ProtocolError
 
 TESTS_DIR = Path(__file__).parent
 sys.path.insert(0, str(TESTS_DIR.parent))
@@ -10,7 +16,8 @@ from vistopian.visitor import Visitor
 
 
 @pytest.fixture
-def visitor():
+def visitor(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
     return Visitor(token="")
 
 
@@ -85,4 +92,483 @@ def test_search(visitor: Visitor, keyword: str, expected: tuple):
             item["share_desc"],
             item["data_type"],
         ) == expected for item in data
-    ])
\ No newline at end of file
+    ])
+
+
+def test_download_adaptive(tmpdir):
+
+    def download(url, fname):
+        with open(fname, "wb") as fp:
+            return fp.write(url.encode())
+
+    jobs = [(f"segment-{i}", Path(tmpdir) / f"{i}.ts") for i in range(50)]
+    Visitor._download_adaptive(download, jobs, initial=2, interval=0)
+
+    for url, fname in jobs:
+        assert fname.read_bytes() == url.encode()
+
+
+def test_download_adaptive_ignores_skipped(tmpdir):
+    # 续传时跳过的分段不计入吞吐量，不应因此提高并发数
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def download(url, fname):
+        with lock:
+            active.append(url)
+            peak.append(len(active))
+        time.sleep(0.001)
+        with lock:
+            active.remove(url)
+        return 0
+
+    jobs = [(f"segment-{i}", Path(tmpdir) / f"{i}.ts") for i in range(50)]
+    Visitor._download_adaptive(download, jobs, initial=2, interval=0)
+
+    assert max(peak) <= 2
+
+
+class ConcurrencyProbe:
+    # 记录每次调用开始时的并发数；size 决定每个任务报告的字节数
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peaks = []
+
+    def __call__(self, url, fname):
+        with self.lock:
+            self.active += 1
+            self.peaks.append(self.active)
+        time.sleep(0.005)
+        with self.lock:
+            self.active -= 1
+        return self.size()
+
+
+def test_download_adaptive_scales_up(tmpdir):
+    # 每个任务耗时固定，吞吐量随并发数增长，控制器应持续加线程
+    probe = ConcurrencyProbe(lambda: 1 << 20)
+    jobs = [(f"segment-{i}", Path(tmpdir) / f"{i}.ts") for i in range(300)]
+    Visitor._download_adaptive(probe, jobs, initial=1, ceiling=8,
+                               interval=0.02)
+
+    assert probe.peaks[0] == 1
+    assert max(probe.peaks) >= 4
+    assert max(probe.peaks) <= 8
+
+
+def test_download_adaptive_scales_down(tmpdir):
+    # 每个任务报告的字节数随时间指数衰减，吞吐量持续下降，控制器应减线程
+    start = time.monotonic()
+    probe = ConcurrencyProbe(
+        lambda: int(1e12 * 0.1 ** ((time.monotonic() - start) / 0.02)))
+    jobs = [(f"segment-{i}", Path(tmpdir) / f"{i}.ts") for i in range(300)]
+    Visitor._download_adaptive(probe, jobs, initial=8, ceiling=8,
+                               interval=0.02)
+
+    assert max(probe.peaks[:8]) == 8
+    assert max(probe.peaks[-20:]) <= 3
+
+
+def test_download_adaptive_raises(tmpdir):
+
+    def download(url, fname):
+        raise RuntimeError(url)
+
+    with pytest.raises(RuntimeError):
+        Visitor._download_adaptive(
+            download, [("segment", Path(tmpdir) / "0.ts")])
+
+
+class FakeRaw(io.BytesIO):
+    decode_content = False
+
+
+class FakeResponse:
+    # 模拟 session.get(stream=True) / session.head 的响应
+
+    def __init__(self, body=b"", status_code=200, headers=None, raw=None):
+        self.raw = raw if raw is not None else FakeRaw(body)
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size=1):
+        return iter(lambda: self.raw.read(chunk_size), b"")
+
+
+def test_download_retries_stream_errors(tmpdir):
+
+    class BrokenRaw(FakeRaw):
+        def read(self, *args):
+            if self.tell() > 0:
+                raise ProtocolError("Connection reset by peer")
+            return super().read(3)
+
+    responses = [FakeResponse(raw=BrokenRaw(b"partial body")),
+                 FakeResponse(b"full body")]
+    visitor = Visitor(token="", use_cache=False)
+    visitor.session.get = lambda *args, **kwargs: responses.pop(0)
+
+    fname = Path(tmpdir) / "0.ts"
+    assert visitor._download("https://example.com/0.ts", fname) == 9
+    assert fname.read_bytes() == b"full body"
+
+
+def test_download_does_not_retry_connection_errors(tmpdir):
+    # 连接失败已由 session 上的 Retry 处理，手动重试只针对读取响应体
+    calls = []
+
+    def get(*args, **kwargs):
+        calls.append(args)
+        raise requests.ConnectionError("Connection refused")
+
+    visitor = Visitor(token="", use_cache=False)
+    visitor.session.get = get
+
+    fname = Path(tmpdir) / "0.ts"
+    with pytest.raises(requests.ConnectionError):
+        visitor._download("https://example.com/0.ts", fname)
+    assert len(calls) == 1
+    assert not fname.exists()
+
+
+@pytest.mark.parametrize("headers, downloaded", [
+    ({"Content-Length": "8"}, False),
+    ({"Content-Length": "100"}, True),
+    ({}, True),
+])
+def test_download_ts_resume(tmpdir, headers, downloaded):
+    fname = Path(tmpdir) / "0.ts"
+    fname.write_bytes(b"existing")
+    gets = []
+
+    def get(*args, **kwargs):
+        gets.append(args)
+        return FakeResponse(b"fresh segment")
+
+    visitor = Visitor(token="", use_cache=False)
+    visitor.session.head = lambda *args, **kwargs: FakeResponse(
+        headers=headers)
+    visitor.session.get = get
+
+    size = visitor._download_ts("https://example.com/0.ts", fname)
+    if downloaded:
+        assert len(gets) == 1
+        assert size == len(b"fresh segment")
+        assert fname.read_bytes() == b"fresh segment"
+    else:
+        assert gets == []
+        assert size == 0
+        assert fname.read_bytes() == b"existing"
+
+
+def test_download_ts_missing(tmpdir):
+    fname = Path(tmpdir) / "0.ts"
+
+    def head(*args, **kwargs):
+        raise AssertionError("HEAD is only needed for existing segments")
+
+    visitor = Visitor(token="", use_cache=False)
+    visitor.session.head = head
+    visitor.session.get = lambda *args, **kwargs: FakeResponse(b"segment")
+
+    assert visitor._download_ts("https://example.com/0.ts", fname) == 7
+    assert fname.read_bytes() == b"segment"
+
+
+@pytest.mark.parametrize("output, kept", [
+    (b"%PDF-1.4", True),
+    (b"", False),
+])
+def test_save_transcript_pdf_error(visitor, tmp_path, monkeypatch,
+                                   output, kept):
+    # wkhtmltopdf 报错但已生成 PDF 时保留文件，没有输出时删除
+    monkeypatch.chdir(tmp_path)
+    catalog = {"title": "show", "catalog": [{"part": [{
+        "sort_number": "1",
+        "title": "episode",
+        "content_url": "https://example.com/1.html",
+    }]}]}
+
+    def convert(fname, pdfname):
+        pdfname.write_bytes(output)
+        raise IOError("wkhtmltopdf exited with non-zero code 1")
+
+    visitor.get_catalog = lambda id: catalog
+    visitor.session.get = lambda *args, **kwargs: FakeResponse(b"<html>")
+    visitor._convert_pdf = convert
+    visitor.save_transcript(id=1)
+
+    assert (tmp_path / "show" / "episode.html").read_bytes() == b"<html>"
+    assert (tmp_path / "show" / "episode.pdf").exists() == kept
+
+
+# 几帧 MPEG-1 Layer III 128kbps/44.1kHz 的空帧，足以让 mutagen 识别
+MP3_FRAMES = (b"\xff\xfb\x90\x64" + b"\x00" * 413) * 5
+ARTICLE = {
+    "title": "【推荐语】",
+    "sort_number": 3,
+    "content_url": "https://api.vistopia.com.cn/article/1",
+}
+SERIES = {"title": "八分", "author": "梁文道"}
+
+
+@pytest.fixture
+def mp3(tmp_path):
+    fname = tmp_path / "episode.mp3"
+    fname.write_bytes(MP3_FRAMES)
+    return fname
+
+
+def test_tag_and_cover(mp3, monkeypatch):
+    from mutagen.id3 import ID3
+    saves = []
+    save = ID3.save
+
+    def counting_save(self, *args, **kwargs):
+        saves.append(args)
+        return save(self, *args, **kwargs)
+
+    monkeypatch.setattr(ID3, "save", counting_save)
+    Visitor._tag_and_cover(str(mp3), ARTICLE, SERIES, cover=b"\xff\xd8jpeg")
+    assert len(saves) == 1
+
+    tags = ID3(str(mp3))
+    assert tags["TIT2"].text == ["【推荐语】"]
+    assert tags["TALB"].text == ["八分"]
+    assert tags["TPE1"].text == ["梁文道"]
+    assert tags["TRCK"].text == ["3"]
+    assert tags["WOAR:https://api.vistopia.com.cn/article/1"].url == \
+        ARTICLE["content_url"]
+    assert tags["APIC:Cover"].data == b"\xff\xd8jpeg"
+    assert tags["APIC:Cover"].mime == "image/jpeg"
+
+
+def test_tag_and_cover_cover_only(mp3):
+    from mutagen.id3 import ID3
+
+    Visitor._tag_and_cover(str(mp3), ARTICLE, SERIES,
+                           no_tag=True, cover=b"\xff\xd8jpeg")
+
+    tags = ID3(str(mp3))
+    assert list(tags.keys()) == ["APIC:Cover"]
+    assert mp3.read_bytes().endswith(MP3_FRAMES)
+
+
+PLAYLIST = (
+    "#EXTM3U\n"
+    "#EXTINF:6.0,\nseg0.ts\n"
+    "{marker}"
+    "#EXTINF:6.0,\nseg1.ts\n"
+    "#EXT-X-ENDLIST\n"
+)
+
+
+@pytest.mark.parametrize("marker, merge", [
+    ("", "remux"),
+    ("#EXT-X-DISCONTINUITY\n", "concat"),
+    ('#EXT-X-MAP:URI="init.mp4"\n', "concat"),
+])
+def test_download_m3u8_merge(tmp_path, marker, merge):
+    playlist = FakeResponse()
+    playlist.text = PLAYLIST.format(marker=marker)
+    merged = []
+
+    def download_ts(url, fname):
+        return fname.write_bytes(url.encode())
+
+    visitor = Visitor(token="", use_cache=False)
+    visitor.session.get = lambda *args, **kwargs: playlist
+    visitor._download_ts = download_ts
+    visitor._remux_ts = lambda files, fname: merged.append(
+        ("remux", [f.read_bytes() for f in files]))
+    visitor._concat_ts = lambda files, fname: merged.append(
+        ("concat", [f.read_bytes() for f in files]))
+
+    fname = tmp_path / "video.mkv"
+    visitor._download_m3u8("https://example.com/v/index.m3u8", fname)
+
+    assert merged == [(merge, [b"https://example.com/v/seg0.ts",
+                               b"https://example.com/v/seg1.ts"])]
+    assert not (tmp_path / "video").exists()
+
+
+class FakeFfmpeg:
+    # 替换 ffmpeg.input(...).output(...).run_async(...) 返回的进程
+
+    class Stdin(io.BytesIO):
+        def __init__(self, broken):
+            super().__init__()
+            self.broken = broken
+            self.data = b""
+
+        def write(self, b):
+            if self.broken:
+                raise BrokenPipeError
+            return super().write(b)
+
+        def close(self):
+            self.data = self.getvalue()
+            super().close()
+
+    def __init__(self, returncode, broken=False):
+        self.stdin = self.Stdin(broken)
+        self.returncode = returncode
+
+    def input(self, *args, **kwargs):
+        return self
+
+    def output(self, *args, **kwargs):
+        return self
+
+    def run_async(self, *args, **kwargs):
+        return self
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+
+@pytest.fixture
+def ts_files(tmp_path):
+    files = [tmp_path / f"{i}.ts" for i in range(3)]
+    for i, f in enumerate(files):
+        f.write_bytes(f"segment{i}".encode())
+    return files
+
+
+def test_remux_ts(ts_files, tmp_path, monkeypatch):
+    import ffmpeg
+    fake = FakeFfmpeg(returncode=0)
+    monkeypatch.setattr(ffmpeg, "input", fake.input)
+
+    Visitor._remux_ts(ts_files, tmp_path / "video.mkv")
+    assert fake.stdin.data == b"segment0segment1segment2"
+
+
+@pytest.mark.parametrize("returncode, broken", [
+    (1, True),
+    (1, False),
+])
+def test_remux_ts_ffmpeg_error(ts_files, tmp_path, monkeypatch,
+                               returncode, broken):
+    # ffmpeg 提前退出导致断管时，报告 ffmpeg 的失败而不是 BrokenPipeError
+    import ffmpeg
+    fake = FakeFfmpeg(returncode=returncode, broken=broken)
+    monkeypatch.setattr(ffmpeg, "input", fake.input)
+
+    with pytest.raises(ffmpeg.Error):
+        Visitor._remux_ts(ts_files, tmp_path / "video.mkv")
+
+
+class FakeApi:
+    # 模拟 API：记录每次请求头，带上匹配的 ETag 时返回 304
+
+    class Response:
+        def __init__(self, status_code, data, headers):
+            self.status_code = status_code
+            self.headers = headers
+            self._data = data
+
+        def json(self):
+            return {"status": "success", "data": self._data}
+
+    def __init__(self, data, etag='"v1"'):
+        self.data = data
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        validators = {"ETag": self.etag,
+                      "Last-Modified": "Wed, 14 Oct 2026 00:00:00 GMT"}
+        if headers.get("If-None-Match") == self.etag:
+            return self.Response(304, None, validators)
+        return self.Response(200, self.data, validators)
+
+
+def test_api_cache_fresh(visitor):
+    api = FakeApi({"title": "八分"})
+    visitor.session.get = api.get
+
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"title": "八分"}
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"title": "八分"}
+    assert api.requests == [{}]
+
+
+def test_api_cache_persists_across_instances(visitor):
+    api = FakeApi({"title": "八分"})
+    visitor.session.get = api.get
+    visitor.get_api_response("content/catalog/11")
+
+    other = Visitor(token="")
+    other.session.get = api.get
+    assert other.get_api_response("content/catalog/11") == {"title": "八分"}
+    assert len(api.requests) == 1
+
+
+def test_api_cache_not_modified(visitor, monkeypatch):
+    monkeypatch.setattr("vistopian.visitor.CACHE_TTL", 0)
+    api = FakeApi({"title": "八分"})
+    visitor.session.get = api.get
+
+    visitor.get_api_response("content/catalog/11")
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"title": "八分"}
+    assert api.requests[1] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 14 Oct 2026 00:00:00 GMT",
+    }
+
+    # 304 之后缓存仍可继续用于条件请求
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"title": "八分"}
+    assert api.requests[2]["If-None-Match"] == '"v1"'
+
+
+def test_api_cache_modified(visitor, monkeypatch):
+    monkeypatch.setattr("vistopian.visitor.CACHE_TTL", 0)
+    api = FakeApi({"episodes": 1})
+    visitor.session.get = api.get
+    visitor.get_api_response("content/catalog/11")
+
+    api.data, api.etag = {"episodes": 2}, '"v2"'
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"episodes": 2}
+    assert visitor.get_api_response("content/catalog/11") == \
+        {"episodes": 2}
+    assert api.requests[2]["If-None-Match"] == '"v2"'
+
+
+def test_api_cache_disabled(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    visitor = Visitor(token="", use_cache=False)
+    api = FakeApi({"title": "八分"})
+    visitor.session.get = api.get
+
+    visitor.get_api_response("content/catalog/11")
+    visitor.get_api_response("content/catalog/11")
+    assert api.requests == [{}, {}]
+    assert not (tmp_path / "vistopia").exists()
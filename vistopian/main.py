@@ -26,6 +26,8 @@ class Context:
 @click.group()
 @click.option("-t", "--token", help="API token.")
 @click.option("-v", "--verbosity", default="INFO", help="Logging level.")
+@click.option("--no-cache", is_flag=True, default=False,
+              help="Do not use the on-disk API response cache.")
 @click.pass_context
 def main(ctx, **argv):
 
@@ -37,7 +39,7 @@ def main(ctx, **argv):
     logger.debug(f"API token `{token}` received.")
 
     ctx.obj = Context()
-    ctx.obj.visitor = Visitor(token=token)
+    ctx.obj.visitor = Visitor(token=token, use_cache=not argv.pop("no_cache"))
 
 
 @main.command("search")
@@ -47,7 +49,9 @@ def main(ctx, **argv):
 def search(ctx, **argv):
     visitor: Visitor = ctx.obj.visitor
     search_result_list = visitor.search(argv.pop("keyword"))
-    logger.debug(json.dumps(search_result_list, indent=2, ensure_ascii=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(
+            search_result_list, indent=2, ensure_ascii=False))
 
     table = []
     for item in search_result_list:
@@ -88,9 +92,10 @@ def show_content(ctx, **argv):
     visitor: Visitor = ctx.obj.visitor
 
     content_id = argv.pop("id")
-    logger.debug(visitor.get_content_show(content_id))
-    logger.debug(json.dumps(
-        visitor.get_catalog(content_id), indent=2, ensure_ascii=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(visitor.get_content_show(content_id))
+        logger.debug(json.dumps(
+            visitor.get_catalog(content_id), indent=2, ensure_ascii=False))
 
     table = []
     catalog = visitor.get_catalog(content_id)
@@ -117,8 +122,9 @@ def save_show(ctx, **argv):
     episode_id = argv.pop("episode_id", None)
     episodes = set(range_expand(episode_id)) if episode_id else None
 
-    logger.debug(json.dumps(
-        ctx.obj.visitor.get_catalog(content_id), indent=2, ensure_ascii=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(ctx.obj.visitor.get_catalog(content_id),
+                                indent=2, ensure_ascii=False))
 
     ctx.obj.visitor.save_show(
         content_id,
@@ -136,8 +142,9 @@ def save_transcript(ctx, **argv):
     episode_id = argv.pop("episode_id", None)
     episodes = set(range_expand(episode_id)) if episode_id else None
 
-    logger.debug(json.dumps(
-        ctx.obj.visitor.get_catalog(content_id), indent=2, ensure_ascii=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(ctx.obj.visitor.get_catalog(content_id),
+                                indent=2, ensure_ascii=False))
 
     ctx.obj.visitor.save_transcript(
         content_id,
@@ -1,41 +1,175 @@
+import hashlib
 import json
-
+import os
+import shutil
+import subprocess
+import time
+import traceback
+
+import diskcache
+import ffmpeg
+import pdfkit
 import requests
+from mutagen.id3 import (
+    ID3, ID3NoHeaderError, APIC, TALB, TIT2, TPE1, TRCK, WOAR
+)
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import IncompleteRead, ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin
-from urllib.request import urlretrieve, urlcleanup
-from logging import getLogger
+from logging import getLogger, DEBUG
 from functools import lru_cache
-from typing import Optional
+from pathlib import Path
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+)
+from typing import Dict, Iterable, Iterator, List, Optional
 
 logger = getLogger(__name__)
 
+# 读取响应体中途出错时的重试次数及需要重试的异常；建立连接的失败已由
+# session 上的 Retry 重试过，不在此重复
+DOWNLOAD_RETRIES = 5
+STREAM_ERRORS = (ProtocolError, ReadTimeoutError, IncompleteRead)
+# 同时下载的音频节目数，过高容易触发服务端限流
+MAX_EPISODE_WORKERS = 4
+# 单个视频同时下载的 ts 分段数，从 INITIAL 开始按吞吐量自动调整，不超过 MAX
+INITIAL_SEGMENT_WORKERS = 4
+MAX_SEGMENT_WORKERS = 32
+# 同时下载的文稿数
+MAX_TRANSCRIPT_WORKERS = 16
+# 每个主机保留的长连接数，需覆盖同时工作的线程数，否则多出的连接用完即被丢弃
+MAX_CONNECTIONS = max(MAX_EPISODE_WORKERS + MAX_SEGMENT_WORKERS,
+                      MAX_TRANSCRIPT_WORKERS)
+API_BASE = "https://api.vistopia.com.cn/api/v1/"
+# 文稿中的相对资源路径及其替换
+ASSET_PREFIX = b'="/assets/'
+ASSET_URL = b'="https://api.vistopia.com.cn/assets/'
+# API 响应缓存：CACHE_TTL 秒内直接使用，之后同步发起条件请求确认是否有更新
+# （如新增的单集）；缓存保留到 CACHE_EXPIRE，用于条件请求
+CACHE_TTL = 5 * 60
+CACHE_EXPIRE = 30 * 24 * 60 * 60
+
+
+def cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "vistopia")
+
+
+def parse_m3u8(text: str, url: str) -> List[str]:
+    '''Extract absolute segment URIs from a media playlist.
+
+    >>> parse_m3u8("#EXTM3U\\n#EXTINF:6.0,\\nseg0.ts\\n\\n#EXTINF:6.0,\\n"
+    ...            "https://cdn.example.com/seg1.ts\\n#EXT-X-ENDLIST\\n",
+    ...            "https://example.com/video/index.m3u8")
+    ['https://example.com/video/seg0.ts', 'https://cdn.example.com/seg1.ts']
+    '''
+    lines = (line.strip() for line in text.splitlines())
+    return [urljoin(url, line)
+            for line in lines if line and not line.startswith("#")]
+
+
+def rewrite_asset_urls(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    '''Point relative `/assets/` links at the API host, chunk by chunk.
+
+    >>> b"".join(rewrite_asset_urls([b'<img src="/as', b'sets/a.png">']))
+    b'<img src="https://api.vistopia.com.cn/assets/a.png">'
+    '''
+    # 保留末尾可能被分块截断的半个匹配，拼上下一块后再替换
+    keep = len(ASSET_PREFIX) - 1
+    tail = b""
+    for chunk in chunks:
+        buf = (tail + chunk).replace(ASSET_PREFIX, ASSET_URL)
+        tail = buf[-keep:]
+        yield buf[:-keep]
+    yield tail
+
 
 class Visitor:
-    def __init__(self, token: str):
+    def __init__(self, token: str, use_cache: bool = True):
         self.token = token
 
+        # 复用连接，避免每次请求重新握手
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip",
+        })
+        retry = Retry(total=5, backoff_factor=0.3,
+                      status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=10,
+                              pool_maxsize=MAX_CONNECTIONS, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # 跨进程持久化的 API 缓存，重复运行时无需再次请求节目信息
+        self._http_cache = diskcache.Cache(cache_dir()) if use_cache else None
+
     def get_api_response(self, uri: str, params: Optional[dict] = None):
 
-        url = urljoin("https://api.vistopia.com.cn/api/v1/", uri)
+        url = urljoin(API_BASE, uri)
 
         if params is None:
             params = {}
 
         params.update({"api_token": self.token})
 
-        logger.debug(f"Visiting {url}")
+        # 新鲜的缓存直接返回，过期后带上缓存做条件请求
+        key = hashlib.sha256(
+            json.dumps([url, sorted(params.items())]).encode()).hexdigest()
+        cached = None
+        if self._http_cache is not None:
+            cached = self._http_cache.get(key)
+        if cached is not None:
+            timestamp, data, _ = cached
+            age = time.time() - timestamp
+            if age < CACHE_TTL:
+                logger.debug(f"Using cached {url}")
+                return data
 
-        response = requests.get(url, params=params).json()
-        if response["status"] != "success":
-            logger.error(f"访问 {url} 失败")
-            logger.error(json.dumps(response, indent=4))
-            raise RuntimeError
-        if "data" not in response.keys():
-            logger.error(f"访问 {url} 失败")
-            logger.error(json.dumps(response, indent=4))
-            raise RuntimeError
+        return self._fetch_api_response(url, params, key, cached)
 
-        return response["data"]
+    def _fetch_api_response(self, url: str, params: dict, key: str,
+                            cached: Optional[tuple] = None):
+
+        logger.debug(f"Visiting {url}")
+
+        # 带上缓存的 ETag / Last-Modified 做条件请求，未变化时服务端返回 304
+        headers = {}
+        validators = {}
+        if cached is not None:
+            validators = cached[2]
+            if "ETag" in validators:
+                headers["If-None-Match"] = validators["ETag"]
+            if "Last-Modified" in validators:
+                headers["If-Modified-Since"] = validators["Last-Modified"]
+
+        r = self.session.get(
+            url, params=params, headers=headers, timeout=(5, 30))
+        if r.status_code == 304 and cached is not None:
+            logger.debug(f"Not modified {url}")
+            data = cached[1]
+        else:
+            response = r.json()
+            if response["status"] != "success":
+                logger.error(f"访问 {url} 失败")
+                logger.error(json.dumps(response, indent=4))
+                raise RuntimeError
+            if "data" not in response.keys():
+                logger.error(f"访问 {url} 失败")
+                logger.error(json.dumps(response, indent=4))
+                raise RuntimeError
+            data = response["data"]
+            validators = {}
+
+        for name in ("ETag", "Last-Modified"):
+            if name in r.headers:
+                validators[name] = r.headers[name]
+
+        if self._http_cache is not None:
+            self._http_cache.set(key, (time.time(), data, validators),
+                                 expire=CACHE_EXPIRE)
+        return data
 
     @lru_cache()
     def get_catalog(self, id: int):
@@ -44,12 +178,8 @@ class Visitor:
 
     @lru_cache()
     def get_user_subscriptions_list(self):
-        data = []
-        while True:
-            response = self.get_api_response("user/subscriptions-list")
-            data.extend(response["data"])
-            break
-        return data
+        response = self.get_api_response("user/subscriptions-list")
+        return response["data"]
 
     @lru_cache()
     def search(self, keyword: str) -> list:
@@ -64,114 +194,249 @@ class Visitor:
     def save_show(self, id: int,
                   no_tag: bool = False, no_cover: bool = False,
                   episodes: Optional[set] = None):
-        from pathlib import Path
-
-        def download(url: str, fname: Path):
-            import socket
-            socket.setdefaulttimeout(60)
-            try:
-                urlretrieve(url, fname)
-            except socket.timeout:
-                count = 1
-                while count <= 5:
-                    try:
-                        urlretrieve(url, fname)
-                        break
-                    except socket.timeout:
-                        logger.warning(f"下载 {fname}，重试 {count} 次")
-                        count += 1
-                if count > 5:
-                    logger.warning(f"下载 {fname} 失败")
-                    fname.unlink()
-
-        def download_m3u8(url: str, fname: Path):
-            import m3u8
-            import ffmpeg
-            from concurrent.futures import ThreadPoolExecutor
-
-            # 通过m3u8下载视频
-            playlist = m3u8.load(url)
-            ts_list = playlist.segments.uri
-            ts_list = [urljoin(url, ts) for ts in ts_list]
-            # 分段下载文件后进行合并
-            folder = Path(fname).parent / Path(fname).stem
-            folder.mkdir(exist_ok=True)
-            # 并发下载ts文件
-            logger.info(f"-->开始下载 {folder} ts 共 {len(ts_list)} ...")
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                executor.map(download, ts_list, [folder / Path(ts).name for ts in ts_list])
-            logger.info(f"-->下载完成 {folder} ts 文件")
-            # 合并文件
-            logger.info(f"-->开始合并 {fname} 文件...")
-            with open(folder / 'filelist.txt', 'wb') as f:
-                for ts in ts_list:
-                    f.write(f"file '{(folder / Path(ts).name).absolute()}'\n".encode())
-            # 使用ffmpeg合并ts文件, 生成mp4文件
-            (ffmpeg.input(folder / 'filelist.txt', format='concat', safe=0)
-             .output(filename=fname, codec='copy', loglevel='quiet').run())
-            logger.info(f"-->合并完成 {fname} 文件")
-            # 删除临时文件
-            for ts in ts_list:
-                (folder / Path(ts).name).unlink(missing_ok=True)
-            (folder / 'filelist.txt').unlink(missing_ok=True)
-            folder.rmdir()
-
-        catalog = self.get_catalog(id)
-        series = self.get_content_show(id)
-        logger.debug(f"catalog {json.dumps(catalog, indent=4)}")
-        logger.debug(f"series {json.dumps(series, indent=4)}")
+        # 两个接口互不依赖，并发请求
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            catalog_future = executor.submit(self.get_catalog, id)
+            series_future = executor.submit(self.get_content_show, id)
+            catalog, series = catalog_future.result(), series_future.result()
+        if logger.isEnabledFor(DEBUG):
+            logger.debug(f"catalog {json.dumps(catalog, indent=4)}")
+            logger.debug(f"series {json.dumps(series, indent=4)}")
 
         show_dir = Path(catalog["title"])
         show_dir.mkdir(exist_ok=True)
 
-        self.save_meta(catalog, download, series, show_dir)
+        self.save_meta(catalog, self._download, series, show_dir)
+        # 所有单集共用 save_meta 刚下载的封面，提交任务前读入一次
+        cover = None if no_cover else (show_dir / "cover.jpg").read_bytes()
 
-        for part in catalog["catalog"]:
-            for article in part["part"]:
+        # 音频并发下载，视频在主线程下载（ts 分段已并发）
+        with ThreadPoolExecutor(max_workers=MAX_EPISODE_WORKERS) as executor:
+            futures = {}
+            try:
+                for part in catalog["catalog"]:
+                    for article in part["part"]:
 
-                if episodes is not None and \
-                        int(article["sort_number"]) not in episodes:
-                    continue
+                        if episodes is not None and \
+                                int(article["sort_number"]) not in episodes:
+                            continue
+
+                        title = article["title"].replace("/", "\\")
+                        media_type = article["media_type_en"]
+                        if media_type == 'audio':
+                            fname = show_dir / f"{title}.mp3"
+                        elif media_type == 'video':
+                            fname = show_dir / f"{title}.mkv"
+                        else:
+                            raise NotImplementedError
+
+                        if fname.exists():
+                            logger.info(f"跳过已存在 {fname}")
+                            continue
+
+                        logger.info(f"开始下载 {fname} ...")
+                        if logger.isEnabledFor(DEBUG):
+                            logger.debug(json.dumps(article, indent=2))
+
+                        if media_type == 'audio':
+                            future = executor.submit(
+                                self._save_audio, article, fname, series,
+                                no_tag, cover)
+                            futures[future] = fname
+                            continue
 
-                title = article["title"].replace("/", "\\")
-                media_type = article["media_type_en"]
-                if media_type == 'audio':
-                    fname = show_dir / "{}.mp3".format(title)
-                elif media_type == 'video':
-                    fname = show_dir / "{}.mkv".format(title)
-                else:
-                    raise NotImplementedError
-
-                if not fname.exists():
-                    logger.info(f"开始下载 {fname} ...")
-                    logger.debug(json.dumps(article, indent=2))
-
-                    if media_type == 'audio':
-                        download(article["media_key_full_url"], fname)
-                        if not no_tag:
-                            self.retag(str(fname), article, catalog, series)
-                        if not no_cover:
-                            self.retag_cover(str(fname), article, catalog, series)
-                    else:
                         # 优选最高分辨率
-                        best_quality = article['media_files'][0]['quality']
-                        video_m3u8 = article['media_files'][0]['media_key_full_url']
-                        for media_file in article['media_files']:
-                            if int(media_file['quality']) > int(best_quality):
-                                best_quality = media_file['quality']
-                                video_m3u8 = media_file['media_key_full_url']
+                        best = max(article['media_files'],
+                                   key=lambda m: int(m['quality']))
+                        video_m3u8 = best['media_key_full_url']
                         try:
-                            download_m3u8(video_m3u8, fname)
-                        except Exception as e:
-                            import traceback
+                            self._download_m3u8(video_m3u8, fname)
+                        except Exception:
                             logger.error(f"下载 {fname} 失败")
                             logger.error(traceback.format_exc())
                             fname.unlink(missing_ok=True)
                             continue
+                        logger.info(f"下载完成 {fname}")
 
+                for future in as_completed(futures):
+                    fname = futures[future]
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.error(f"下载 {fname} 失败")
+                        logger.error(traceback.format_exc())
+                        fname.unlink(missing_ok=True)
+                        continue
                     logger.info(f"下载完成 {fname}")
+            except BaseException:
+                # 中断时取消尚未开始的下载，不必等整档节目下载完才退出
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    def _download(self, url: str, fname: Path) -> int:
+        # 建立连接及收到响应头之前的失败由 session 上挂载的 Retry 负责；
+        # 读取响应体时的超时、断连在这里重试，每次重新写入文件
+        count = 0
+        while True:
+            try:
+                with self.session.get(url, stream=True,
+                                      timeout=(10, 60)) as r:
+                    r.raise_for_status()
+                    r.raw.decode_content = True
+                    with open(fname, "wb") as f:
+                        shutil.copyfileobj(r.raw, f, length=1 << 20)
+                        return f.tell()
+            except STREAM_ERRORS:
+                count += 1
+                if count <= DOWNLOAD_RETRIES:
+                    logger.warning(f"下载 {fname}，重试 {count} 次")
+                    continue
+                logger.warning(f"下载 {fname} 失败")
+                Path(fname).unlink(missing_ok=True)
+                raise
+            except Exception:
+                logger.warning(f"下载 {fname} 失败")
+                Path(fname).unlink(missing_ok=True)
+                raise
+
+    @staticmethod
+    def _download_adaptive(download, jobs,
+                           initial: int = INITIAL_SEGMENT_WORKERS,
+                           ceiling: int = MAX_SEGMENT_WORKERS,
+                           interval: float = 2.0, alpha: float = 0.5):
+        # 按实测吞吐量动态调整并发数：每隔 interval 秒计算一次吞吐量的
+        # 指数加权平均，仍在上升则加一个线程，明显下降则减一个，持平则保持。
+        # download 返回本次实际下载的字节数，跳过的文件应返回 0
+        jobs = iter(jobs)
+        limit = initial
+        running: Dict[Future, tuple] = {}
+        ewma = None
+        window_bytes = 0
+        window_start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=ceiling) as executor:
+            while True:
+                while len(running) < limit:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    running[executor.submit(download, *job)] = job
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    window_bytes += future.result()
+
+                now = time.monotonic()
+                elapsed = now - window_start
+                if elapsed < interval or elapsed <= 0:
+                    continue
+                rate = window_bytes / elapsed
+                if ewma is not None:
+                    previous = ewma
+                    ewma = alpha * rate + (1 - alpha) * ewma
+                    if ewma > previous * 1.05:
+                        limit = min(limit + 1, ceiling)
+                    elif ewma < previous * 0.95:
+                        limit = max(limit - 1, 1)
+                    logger.debug(f"吞吐量 {ewma / 1024:.0f} KiB/s，并发 {limit}")
                 else:
-                    logger.info(f"跳过已存在 {fname}")
+                    # 首个窗口只有基准值，先加一个线程试探，否则吞吐量
+                    # 平稳时会一直停在初始并发数
+                    ewma = rate
+                    if rate > 0:
+                        limit = min(limit + 1, ceiling)
+                window_bytes = 0
+                window_start = now
+
+    def _download_m3u8(self, url: str, fname: Path):
+        # 通过m3u8下载视频
+        r = self.session.get(url, timeout=(10, 60))
+        r.raise_for_status()
+        ts_list = parse_m3u8(r.text, url)
+        # 连续的 MPEG-TS 分段可按字节直接拼接
+        continuous = "#EXT-X-DISCONTINUITY" not in r.text and \
+            "#EXT-X-MAP" not in r.text
+        # 分段下载文件后进行合并
+        folder = Path(fname).parent / Path(fname).stem
+        folder.mkdir(exist_ok=True)
+        # 并发下载ts文件
+        logger.info(f"-->开始下载 {folder} ts 共 {len(ts_list)} ...")
+        self._download_adaptive(
+            self._download_ts,
+            [(ts, folder / Path(ts).name) for ts in ts_list])
+        logger.info(f"-->下载完成 {folder} ts 文件")
+        # 合并文件
+        logger.info(f"-->开始合并 {fname} 文件...")
+        ts_files = [folder / Path(ts).name for ts in ts_list]
+        if continuous:
+            self._remux_ts(ts_files, fname)
+        else:
+            # 存在不连续分段时交给 concat demuxer 处理时间戳
+            self._concat_ts(ts_files, fname)
+        logger.info(f"-->合并完成 {fname} 文件")
+        # 合并成功后才删除临时文件，失败时保留已下载的分段以便续传；
+        # 清理失败不影响已合并好的视频
+        shutil.rmtree(folder, ignore_errors=True)
+
+    @staticmethod
+    def _concat_ts(ts_files: List[Path], fname: Path):
+        filelist = "".join(
+            f"file '{ts_file.absolute()}'\n" for ts_file in ts_files
+        ).encode()
+        # 使用ffmpeg合并ts文件, 文件列表经 stdin 传入，不落盘
+        (ffmpeg.input('pipe:', format='concat', safe=0,
+                      protocol_whitelist='file,pipe')
+         .output(filename=str(fname), codec='copy', loglevel='quiet')
+         .run(input=filelist))
+
+    @staticmethod
+    def _remux_ts(ts_files: List[Path], fname: Path):
+        # 按顺序把分段字节写入 ffmpeg 的 stdin，作为一条连续的 MPEG-TS 流
+        # 直接封装为 mkv，ffmpeg 不必逐个分段重新探测和拼接时间戳
+        process = (ffmpeg.input('pipe:', format='mpegts')
+                   .output(filename=str(fname), codec='copy', loglevel='quiet')
+                   .run_async(pipe_stdin=True))
+        broken = False
+        try:
+            for ts_file in ts_files:
+                with open(ts_file, "rb") as f:
+                    shutil.copyfileobj(f, process.stdin, length=1 << 20)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg 提前退出时写入会断管，以 ffmpeg 的失败为准报错；
+            # 管道关闭到进程退出之间可能有短暂间隔，稍等再判断
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            broken = True
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            retcode = process.wait()
+        if retcode != 0 or broken:
+            raise ffmpeg.Error('ffmpeg', None, None)
+
+    def _download_ts(self, url: str, fname: Path) -> int:
+        # 跳过上次已完整下载的分段
+        if fname.exists() and fname.stat().st_size > 0:
+            r = self.session.head(url, allow_redirects=True, timeout=(10, 30))
+            length = r.headers.get("Content-Length")
+            if r.ok and length is not None and \
+                    int(length) == fname.stat().st_size:
+                logger.debug(f"跳过已存在 {fname}")
+                return 0
+        return self._download(url, fname)
+
+    def _save_audio(self, article, fname, series,
+                    no_tag: bool = False, cover: Optional[bytes] = None):
+        self._download(article["media_key_full_url"], fname)
+        if not no_tag or cover is not None:
+            self._tag_and_cover(str(fname), article, series, no_tag, cover)
 
     @staticmethod
     def save_meta(catalog, download, series, show_dir):
@@ -204,86 +469,111 @@ class Visitor:
 
     def save_transcript(self, id: int, episodes: Optional[set] = None):
 
-        from pathlib import Path
-
         catalog = self.get_catalog(id)
 
         show_dir = Path(catalog["title"])
         show_dir.mkdir(exist_ok=True)
 
-        for part in catalog["catalog"]:
-            for article in part["part"]:
-
-                if episodes is not None and \
-                        int(article["sort_number"]) not in episodes:
-                    continue
-
-                title = article["title"].replace("/", "\\")
-                fname = show_dir / "{}.html".format(title)
-                if not fname.exists():
-                    logger.info(f"开始下载 {fname} ...")
+        # 文稿下载为 I/O 密集，PDF 转换由 wkhtmltopdf 子进程完成，
+        # 两者各用一个线程池，先下载完成的文稿可以先开始转换
+        with ThreadPoolExecutor(max_workers=MAX_TRANSCRIPT_WORKERS) as fetcher, \
+                ThreadPoolExecutor(max_workers=os.cpu_count()) as converter:
+            html_futures = {}
+            pdf_futures = {}
 
-                    urlretrieve(article["content_url"], fname)
+            def convert(fname: Path, pdfname: Path):
+                if not pdfname.exists():
+                    future = converter.submit(self._convert_pdf, fname, pdfname)
+                    pdf_futures[future] = pdfname
+                else:
+                    logger.info(f"跳过已存在 {pdfname}")
 
-                    with open(fname) as f:
-                        content = f.read()
+            try:
+                for part in catalog["catalog"]:
+                    for article in part["part"]:
 
-                    content = content.replace(
-                        '="/assets/',
-                        '="https://api.vistopia.com.cn/assets/'
-                    )
+                        if episodes is not None and \
+                                int(article["sort_number"]) not in episodes:
+                            continue
 
-                    with open(fname, "w") as f:
-                        f.write(content)
+                        title = article["title"].replace("/", "\\")
+                        fname = show_dir / f"{title}.html"
+                        pdfname = show_dir / f"{title}.pdf"
+                        if not fname.exists():
+                            logger.info(f"开始下载 {fname} ...")
+                            future = fetcher.submit(
+                                self._save_transcript_html, article, fname)
+                            html_futures[future] = (fname, pdfname)
+                        else:
+                            logger.info(f"跳过已存在 {fname}")
+                            convert(fname, pdfname)
+
+                for future in as_completed(html_futures):
+                    fname, pdfname = html_futures[future]
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.error(f"下载 {fname} 失败")
+                        logger.error(traceback.format_exc())
+                        fname.unlink(missing_ok=True)
+                        continue
                     logger.info(f"下载完成 {fname}")
-                else:
-                    logger.info(f"跳过已存在 {fname}")
+                    convert(fname, pdfname)
 
-                pdfname = show_dir / "{}.pdf".format(title)
-                if not pdfname.exists():
-                    logger.info(f"开始转换 {pdfname} ...")
-                    import pdfkit
-                    pdfkit.from_file(str(fname), str(pdfname))
+                for future in as_completed(pdf_futures):
+                    pdfname = pdf_futures[future]
+                    try:
+                        future.result()
+                    except Exception:
+                        # wkhtmltopdf 加载资源失败时也会返回非零，但 PDF
+                        # 往往已完整生成，只在没有输出时才删除
+                        if pdfname.exists() and pdfname.stat().st_size > 0:
+                            logger.warning(f"转换 {pdfname} 时出错，保留已生成的文件")
+                            logger.warning(traceback.format_exc())
+                            continue
+                        logger.error(f"转换 {pdfname} 失败")
+                        logger.error(traceback.format_exc())
+                        pdfname.unlink(missing_ok=True)
+                        continue
                     logger.info(f"转换完成 {pdfname}")
-                else:
-                    logger.info(f"跳过已存在 {pdfname}")
+            except BaseException:
+                # 中断时取消尚未开始的下载和转换，不必等整档节目处理完才退出
+                fetcher.shutdown(cancel_futures=True)
+                converter.shutdown(cancel_futures=True)
+                raise
+
+    def _save_transcript_html(self, article, fname: Path):
+        with self.session.get(article["content_url"], stream=True,
+                              timeout=(10, 60)) as r:
+            r.raise_for_status()
+            with open(fname, "wb") as f:
+                for chunk in rewrite_asset_urls(r.iter_content(1 << 16)):
+                    f.write(chunk)
 
     @staticmethod
-    def retag(fname, article_info, catalog_info, series_info):
-
-        import mutagen
-        from mutagen.easyid3 import EasyID3
-
-        try:
-            track = EasyID3(fname)
-        except mutagen.id3.ID3NoHeaderError:
-            track = mutagen.File(fname, easy=True)
-            track.add_tags()
-
-        track["title"] = article_info["title"]
-        track["album"] = series_info["title"]
-        track["artist"] = series_info["author"]
-        track["tracknumber"] = article_info["sort_number"]
-        # track["tracksort"] = article_info["sort_number"]
-        track["website"] = article_info["content_url"]
-        track.save(v1=2)
+    def _convert_pdf(fname: Path, pdfname: Path):
+        logger.info(f"开始转换 {pdfname} ...")
+        pdfkit.from_file(str(fname), str(pdfname))
 
     @staticmethod
-    def retag_cover(fname, article_info, catalog_info, series_info):
+    def _tag_and_cover(fname, article_info, series_info,
+                       no_tag: bool = False, cover: Optional[bytes] = None):
+        # 标签与封面一次写入，避免重复改写 MP3 头部
 
-        from mutagen.id3 import ID3, APIC
-
-        @lru_cache()
-        def _get_cover(url: str) -> bytes:
-            cover_fname, _ = urlretrieve(url)
-            with open(cover_fname, "rb") as fp:
-                cover = fp.read()
-            urlcleanup()
-            return cover
-
-        cover = _get_cover(catalog_info["background_img"])
-
-        track = ID3(fname)
-        track["APIC"] = APIC(encoding=3, mime="image/jpeg",
-                             type=3, desc="Cover", data=cover)
-        track.save()
+        try:
+            track = ID3(fname)
+        except ID3NoHeaderError:
+            track = ID3()
+
+        if not no_tag:
+            track.add(TIT2(encoding=3, text=article_info["title"]))
+            track.add(TALB(encoding=3, text=series_info["title"]))
+            track.add(TPE1(encoding=3, text=series_info["author"]))
+            track.add(TRCK(encoding=3, text=str(article_info["sort_number"])))
+            track.add(WOAR(url=article_info["content_url"]))
+
+        if cover is not None:
+            track.add(APIC(encoding=3, mime="image/jpeg",
+                           type=3, desc="Cover", data=cover))
+
+        track.save(fname, v1=1 if no_tag else 2)